@@ -1,75 +1,194 @@
 """
 Jarvis MVP - Binance Futures API Client
-Fetch USDT-M Futures positions and calculate risk metrics
+Async aiohttp client for USDT-M Futures positions and risk metrics
 """
-from binance.client import Client
-from binance.exceptions import BinanceAPIException
+import aiohttp
+import asyncio
+import hashlib
+import hmac
+import logging
+import time
 from typing import List, Dict, Optional
-from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from datetime import datetime, timedelta, timezone
 from config import settings
 
+logger = logging.getLogger("jarvis.binance")
+
+# Futures REST endpoints
+FUTURES_BASE_URL = 'https://fapi.binance.com'
+FUTURES_TESTNET_URL = 'https://testnet.binancefuture.com'
+
+# Futures user-data stream endpoints
+FUTURES_STREAM_URL = 'wss://fstream.binance.com/ws'
+FUTURES_STREAM_TESTNET_URL = 'wss://stream.binancefuture.com/ws'
+
+# How long a fetched account payload stays fresh (seconds)
+ACCOUNT_CACHE_TTL = 5.0
+
+# Refresh the listen key well before Binance's 60-minute expiry
+LISTEN_KEY_KEEPALIVE_SECONDS = 1800
+
+# Stream events that affect positions or stop orders
+USER_STREAM_EVENTS = ('ACCOUNT_UPDATE', 'ORDER_TRADE_UPDATE')
+
+# Order types that count as stop loss / take profit protection
+STOP_ORDER_TYPES = frozenset({'STOP_MARKET', 'STOP', 'TAKE_PROFIT_MARKET', 'TAKE_PROFIT'})
+
+# Income history lookback, split into concurrent one-day windows
+INCOME_WINDOW_DAYS = 7
+INCOME_CONCURRENCY = 4
+
+
+class BinanceAPIError(Exception):
+    """Raised when the Binance API returns an error response"""
+
+    def __init__(self, status: int, code: int, message: str):
+        self.status = status
+        self.code = code
+        self.message = message
+        super().__init__(f"Binance API error {code}: {message} (HTTP {status})")
+
 
 class BinanceClient:
-    """Wrapper for Binance Futures API with risk calculations"""
-    
+    """Async wrapper for Binance Futures API with risk calculations"""
+
     def __init__(self, api_key: str, api_secret: str, testnet: bool = True):
-        if testnet:
-            # Binance Futures Testnet
-            self.client = Client(
-                api_key=api_key,
-                api_secret=api_secret,
-                testnet=True
-            )
-            self.client.API_URL = 'https://testnet.binancefuture.com'
-        else:
-            # Production
-            self.client = Client(api_key=api_key, api_secret=api_secret)
-        
         self.api_key = api_key
+        self.api_secret = api_secret
         self.testnet = testnet
-    
-    def get_positions(self, symbol: Optional[str] = None) -> List[Dict]:
+        self.base_url = FUTURES_TESTNET_URL if testnet else FUTURES_BASE_URL
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._account_cache: Optional[tuple] = None  # (fetched_at, account_info)
+        # Key setup for HMAC-SHA256 is paid once; each request copies this
+        self._hmac_prototype = hmac.new(api_secret.encode(), digestmod=hashlib.sha256)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get (or lazily create) the shared HTTP session"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={'X-MBX-APIKEY': self.api_key},
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._session
+
+    async def close(self):
+        """Close the underlying HTTP session"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    def _sign(self, query_string: str) -> str:
+        """Sign request parameters with HMAC-SHA256"""
+        mac = self._hmac_prototype.copy()
+        mac.update(query_string.encode())
+        return mac.hexdigest()
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict] = None,
+        signed: bool = True
+    ) -> Dict:
+        """
+        Send a request to the Futures API
+
+        Signed requests get a timestamp + HMAC-SHA256 signature appended.
+        """
+        params = dict(params or {})
+
+        if signed:
+            params['timestamp'] = int(time.time() * 1000)
+            query_string = urlencode(params)
+            params['signature'] = self._sign(query_string)
+
+        session = self._get_session()
+
+        async with session.request(method, self.base_url + path, params=params) as response:
+            data = await response.json()
+
+            if response.status != 200:
+                raise BinanceAPIError(
+                    status=response.status,
+                    code=data.get('code', -1),
+                    message=data.get('msg', 'Unknown error')
+                )
+
+            return data
+
+    def invalidate_account_cache(self):
+        """Drop the cached account payload so the next fetch is fresh"""
+        self._account_cache = None
+
+    async def _get_account(self) -> Dict:
+        """
+        Fetch the full account payload, cached for a few seconds
+
+        The account endpoint is the single source for both positions and
+        balance, so one fetch per poll tick serves both.
+        """
+        if self._account_cache and time.monotonic() - self._account_cache[0] < ACCOUNT_CACHE_TTL:
+            return self._account_cache[1]
+
+        account_info = await self._request('GET', '/fapi/v2/account')
+        self._account_cache = (time.monotonic(), account_info)
+        return account_info
+
+    async def get_positions(self, symbol: Optional[str] = None) -> List[Dict]:
         """
         Fetch all open USDT-M Futures positions
-        
+
         Returns:
             List of position dicts with calculated risk metrics
         """
         try:
             # Get all positions
-            account_info = self.client.futures_account()
+            account_info = await self._get_account()
             positions = account_info['positions']
-            
+
             # Get account balance for risk calculation
             balance = float(account_info['totalWalletBalance'])
-            
+
             # Filter only open positions and add risk calculations
+            open_raw = [pos for pos in positions if float(pos['positionAmt']) != 0]
+
+            # One open-orders call covers stop loss detection for all symbols
+            sl_symbols = await self._get_stop_loss_symbols() if open_raw else set()
+
+            # One timestamp per fetch, shared by every enriched position;
+            # kept as an epoch float so the snapshot stays JSON-serializable
+            # when it is persisted on an Alert
+            fetched_epoch = time.time()
+
             open_positions = []
-            for pos in positions:
-                position_amt = float(pos['positionAmt'])
-                
-                if position_amt != 0:  # Position is open
-                    enriched = self._enrich_position(pos, balance)
-                    if enriched:
-                        open_positions.append(enriched)
-            
+            for pos in open_raw:
+                enriched = self._enrich_position(pos, balance, sl_symbols, fetched_epoch)
+                if enriched:
+                    open_positions.append(enriched)
+
             # Filter by symbol if specified
             if symbol:
                 open_positions = [p for p in open_positions if p['symbol'] == symbol]
-            
+
             return open_positions
-            
-        except BinanceAPIException as e:
-            print(f"❌ Binance API error: {e}")
+
+        except BinanceAPIError as e:
+            logger.error("Binance API error: %s", e)
             return []
         except Exception as e:
-            print(f"❌ Error fetching positions: {e}")
+            logger.error("Error fetching positions: %s", e)
             return []
-    
-    def _enrich_position(self, position: Dict, balance: float) -> Optional[Dict]:
+
+    def _enrich_position(
+        self,
+        position: Dict,
+        balance: float,
+        sl_symbols: set,
+        fetched_epoch: float
+    ) -> Optional[Dict]:
         """
         Add calculated risk metrics to position
-        
+
         Calculations:
         - Risk%: Position Value / Account Balance * 100
         - Liq Distance%: |Mark Price - Liq Price| / Mark Price * 100
@@ -82,26 +201,26 @@ class BinanceClient:
             leverage = int(position['leverage'])
             unrealized_pnl = float(position['unrealizedProfit'])
             liquidation_price = float(position['liquidationPrice'])
-            
+
             # Side detection
             side = "Long" if position_amt > 0 else "Short"
             size = abs(position_amt)
-            
+
             # Position value in USDT
             position_value = size * mark_price
-            
+
             # Risk% = Position Value / Balance * 100
             risk_pct = (position_value / balance * 100) if balance > 0 else 0
-            
+
             # Liquidation distance%
             if liquidation_price > 0:
                 liq_distance_pct = abs(mark_price - liquidation_price) / mark_price * 100
             else:
                 liq_distance_pct = 999  # No liquidation risk
-            
-            # Stop loss detection (check if stop order exists)
-            has_sl = self._check_stop_loss(symbol)
-            
+
+            # Stop loss detection (stop order exists for this symbol)
+            has_sl = symbol in sl_symbols
+
             # Build enriched position dict
             enriched = {
                 'symbol': symbol,
@@ -115,105 +234,234 @@ class BinanceClient:
                 'unrealized_pnl': unrealized_pnl,
                 'unrealized_pnl_usd': round(unrealized_pnl, 2),
                 'liquidation_price': liquidation_price,
-                
+
                 # Calculated metrics
                 'risk_pct': round(risk_pct, 2),
                 'liq_distance_pct': round(liq_distance_pct, 2),
                 'position_value_usd': round(position_value, 2),
                 'has_stop_loss': has_sl,
-                
-                # Timestamps
-                'updated_time_dt': datetime.utcnow(),
-                'created_time_dt': datetime.utcnow(),
-                
-                # Raw data
-                'raw': position
+
+                # Timestamps (epoch floats; datetimes would break the
+                # JSON position_snapshot column)
+                'updated_epoch': fetched_epoch,
+                'created_epoch': fetched_epoch,
             }
-            
+
             return enriched
-            
+
         except Exception as e:
-            print(f"⚠️ Error enriching position {position.get('symbol')}: {e}")
+            logger.warning("Error enriching position %s: %s", position.get('symbol'), e)
             return None
-    
-    def _check_stop_loss(self, symbol: str) -> bool:
+
+    async def _get_stop_loss_symbols(self) -> set:
         """
-        Check if position has an active stop loss order
-        
+        Find all symbols with an active stop loss order
+
         Returns:
-            True if stop loss exists
+            Set of symbols that have an SL/TP order open
         """
         try:
-            open_orders = self.client.futures_get_open_orders(symbol=symbol)
-            
-            for order in open_orders:
-                order_type = order['type']
-                if order_type in ['STOP_MARKET', 'STOP', 'TAKE_PROFIT_MARKET', 'TAKE_PROFIT']:
-                    return True
-            
-            return False
-            
+            open_orders = await self._request('GET', '/fapi/v1/openOrders')
+
+            return {
+                order['symbol'] for order in open_orders
+                if order['type'] in STOP_ORDER_TYPES
+            }
+
         except Exception as e:
-            print(f"⚠️ Error checking stop loss for {symbol}: {e}")
+            logger.warning("Error checking stop loss orders: %s", e)
+            return set()
+
+    async def validate_credentials(self) -> bool:
+        """
+        Verify API key/secret with a lightweight signed balance call
+
+        /fapi/v2/balance returns a payload a fraction of the size of the
+        full account endpoint, and a signed 200 proves the credentials —
+        a zero balance does not mean they are invalid.
+
+        Returns:
+            True if the credentials sign a request successfully
+        """
+        try:
+            await self._request('GET', '/fapi/v2/balance')
+            return True
+        except BinanceAPIError:
             return False
-    
-    def get_account_balance(self) -> float:
+
+    async def get_account_balance(self) -> float:
         """
         Get USDT Futures wallet balance
-        
+
         Returns:
             Total USDT balance
         """
         try:
-            account = self.client.futures_account()
+            account = await self._get_account()
             balance = float(account['totalWalletBalance'])
             return balance
-            
+
         except Exception as e:
-            print(f"❌ Error fetching balance: {e}")
+            logger.error("Error fetching balance: %s", e)
             return 0.0
-    
-    def get_recent_trades(self, symbol: Optional[str] = None, limit: int = 50) -> List[Dict]:
+
+    async def get_recent_trades(
+        self,
+        symbol: Optional[str] = None,
+        limit: int = 50,
+        since: Optional[datetime] = None
+    ) -> List[Dict]:
         """
         Fetch recent closed trades for revenge pattern detection
-        
+
+        Args:
+            since: Only return trades closed after this time; also trims
+                   how far back the history windows reach
+
         Returns:
             List of realized PnL records with win/loss info
         """
         try:
-            # Get realized PnL history (last 7 days)
-            start_time = int((datetime.utcnow() - timedelta(days=7)).timestamp() * 1000)
-            
-            income_history = self.client.futures_income_history(
-                incomeType='REALIZED_PNL',
-                startTime=start_time,
-                limit=limit
+            # Get realized PnL history in parallel one-day windows: same
+            # bytes, but latency is the slowest window instead of the sum.
+            # All the time math here is epoch seconds — naive datetimes
+            # would shift by the host timezone (since is naive UTC,
+            # repo-wide, so it is pinned to UTC before converting)
+            now_epoch = time.time()
+            sem = asyncio.Semaphore(INCOME_CONCURRENCY)
+
+            # Don't fetch windows entirely older than the caller's cutoff
+            window_days = INCOME_WINDOW_DAYS
+            since_epoch = None
+            if since is not None:
+                since_epoch = since.replace(tzinfo=timezone.utc).timestamp()
+                window_days = min(window_days, int((now_epoch - since_epoch) // 86400) + 1)
+
+            async def fetch_window(days_back: int) -> List[Dict]:
+                async with sem:
+                    return await self._request('GET', '/fapi/v1/income', {
+                        'incomeType': 'REALIZED_PNL',
+                        'startTime': int((now_epoch - (days_back + 1) * 86400) * 1000),
+                        'endTime': int((now_epoch - days_back * 86400) * 1000),
+                        'limit': limit
+                    })
+
+            windows = await asyncio.gather(
+                *(fetch_window(i) for i in range(window_days))
             )
-            
+
+            # Flatten and dedupe by transaction id (window edges can overlap)
+            by_tran = {}
+            for window in windows:
+                for income in window:
+                    by_tran[income['tranId']] = income
+            income_history = list(by_tran.values())
+
             # Filter by symbol if specified
             if symbol:
                 income_history = [i for i in income_history if i['symbol'] == symbol]
-            
+
             # Add normalized fields
             trades = []
             for income in income_history:
                 pnl = float(income['income'])
-                if pnl != 0:  # Skip zero PnL entries
-                    trade = {
-                        'symbol': income['symbol'],
-                        'closed_pnl': pnl,
-                        'is_win': pnl > 0,
-                        'closed_time_dt': datetime.fromtimestamp(income['time'] / 1000),
-                        'transaction_id': income['tranId'],
-                        'raw': income
-                    }
-                    trades.append(trade)
-            
+                if pnl == 0:  # Skip zero PnL entries
+                    continue
+
+                closed_epoch = income['time'] / 1000
+                if since_epoch is not None and closed_epoch < since_epoch:
+                    continue
+
+                trades.append({
+                    'symbol': income['symbol'],
+                    'closed_pnl': pnl,
+                    'is_win': pnl > 0,
+                    # Naive UTC, matching datetime.utcnow() everywhere else
+                    'closed_time_dt': datetime.utcfromtimestamp(closed_epoch),
+                    'closed_epoch': closed_epoch,  # float seconds; cheap age math
+                    'transaction_id': income['tranId'],
+                    'raw': income
+                })
+
             # Sort by time (newest first)
-            trades.sort(key=lambda x: x['closed_time_dt'], reverse=True)
-            
+            trades.sort(key=lambda x: x['closed_epoch'], reverse=True)
+
             return trades
-            
+
         except Exception as e:
-            print(f"❌ Error fetching trades: {e}")
+            logger.error("Error fetching trades: %s", e)
             return []
+
+
+class UserDataStream:
+    """
+    Binance Futures user-data websocket stream
+
+    Binance pushes ACCOUNT_UPDATE / ORDER_TRADE_UPDATE events the moment
+    positions or stop orders change, so risk checks can run on the event
+    instead of waiting for the next REST poll.
+    """
+
+    def __init__(self, client: BinanceClient, on_event):
+        self.client = client
+        self.on_event = on_event  # async callback(event dict)
+        self._listen_key: Optional[str] = None
+        self._ws_task: Optional[asyncio.Task] = None
+        self._keepalive_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._ws_task is not None and not self._ws_task.done()
+
+    async def start(self):
+        """Request a listen key and open the websocket"""
+        data = await self.client._request('POST', '/fapi/v1/listenKey', signed=False)
+        self._listen_key = data['listenKey']
+
+        self._ws_task = asyncio.create_task(self._listen())
+        self._keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def stop(self):
+        """Stop the websocket and keepalive tasks"""
+        for task in (self._ws_task, self._keepalive_task):
+            if task:
+                task.cancel()
+
+        self._ws_task = None
+        self._keepalive_task = None
+
+    async def _listen(self):
+        """Consume stream events, reconnecting on errors"""
+        base = FUTURES_STREAM_TESTNET_URL if self.client.testnet else FUTURES_STREAM_URL
+        url = f"{base}/{self._listen_key}"
+
+        while True:
+            try:
+                session = self.client._get_session()
+
+                async with session.ws_connect(url, heartbeat=60) as ws:
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            continue
+
+                        event = msg.json()
+                        if event.get('e') in USER_STREAM_EVENTS:
+                            await self.on_event(event)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning("User stream error, reconnecting: %s", e)
+                await asyncio.sleep(5)
+
+    async def _keepalive(self):
+        """Ping the listen key periodically so Binance keeps it alive"""
+        while True:
+            await asyncio.sleep(LISTEN_KEY_KEEPALIVE_SECONDS)
+
+            try:
+                await self.client._request('PUT', '/fapi/v1/listenKey', signed=False)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning("Listen key keepalive failed: %s", e)
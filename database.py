@@ -1,63 +1,73 @@
 """
 Jarvis MVP Database Connection
-SQLAlchemy session management
+Async SQLAlchemy session management
 """
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from config import settings
 from models import Base
 
-# Create engine
-engine = create_engine(
-    settings.DATABASE_URL,
+
+def _async_url(url: str) -> str:
+    """Map a plain postgres URL onto the asyncpg driver"""
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+
+_url = _async_url(settings.DATABASE_URL)
+
+_engine_kwargs = dict(
     pool_pre_ping=True,  # Verify connections
-    pool_recycle=3600,   # Recycle connections every hour
+    pool_recycle=1800,   # Recycle connections every 30 minutes
     echo=False           # Set True for SQL debugging
 )
 
+# SQLite has no queue pool to size; only tune it for real servers
+if not _url.startswith("sqlite"):
+    _engine_kwargs.update(pool_size=10, max_overflow=10)
+
+# Create engine
+engine = create_async_engine(_url, **_engine_kwargs)
+
 # Session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
 
-def init_db():
+async def init_db():
     """Initialize database - create all tables"""
     print("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     print("✅ Database initialized")
 
 
-@contextmanager
-def get_db() -> Session:
+@asynccontextmanager
+async def get_db():
     """
-    Context manager for database sessions
-    
+    Async context manager for database sessions
+
     Usage:
-        with get_db() as db:
-            user = db.query(User).first()
+        async with get_db() as db:
+            user = (await db.execute(select(User))).scalars().first()
     """
-    db = SessionLocal()
-    try:
-        yield db
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+    async with SessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
 
 
-def get_db_dependency():
+async def get_db_dependency() -> AsyncSession:
     """
     FastAPI dependency injection
-    
+
     Usage:
         @app.get("/users")
-        def get_users(db: Session = Depends(get_db_dependency)):
-            return db.query(User).all()
+        async def get_users(db: AsyncSession = Depends(get_db_dependency)):
+            return (await db.execute(select(User))).scalars().all()
     """
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -2,68 +2,120 @@
 Jarvis MVP - Main Application
 FastAPI server with background position monitoring
 """
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, update, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
 import asyncio
+import logging
 from datetime import datetime
 from typing import Dict, List
 
-from config import settings
-from database import init_db, get_db_dependency
+from config import settings, BINANCE_TESTNET, POLL_INTERVAL_SECONDS
+from database import init_db, get_db, get_db_dependency
 from models import User, Alert, ButtonClick
-from binance_client import BinanceClient
+from binance_client import BinanceClient, UserDataStream
 from rule_engine import RuleEngine
+from telegram import Update
 from telegram_bot import JarvisTelegramBot
 from scheduler import JarvisScheduler
 
+logger = logging.getLogger("jarvis")
+
 # Global instances
 telegram_bot = None
 scheduler = None
 monitoring_task = None
 
+# Cached per-user Binance clients (keeps HTTP sessions and TLS warm between polls)
+_client_cache: Dict[int, BinanceClient] = {}
+
+# Cached per-user rule engines: cooldown state (last_alert_times) must
+# survive poll ticks, or every ongoing violation re-alerts every 15s
+_engine_cache: Dict[int, RuleEngine] = {}
+
+# Active user-data streams keyed by user id
+_user_streams: Dict[int, UserDataStream] = {}
+
+# Max user checks in flight at once in the monitor loop
+MONITOR_CONCURRENCY = 16
+
+def get_binance_client(user) -> BinanceClient:
+    """Get (or create and cache) the Binance client for a user
+
+    Accepts any row with id / binance_api_key / binance_api_secret.
+    """
+    client = _client_cache.get(user.id)
+
+    if client is None:
+        client = BinanceClient(
+            api_key=user.binance_api_key,
+            api_secret=user.binance_api_secret,
+            testnet=BINANCE_TESTNET
+        )
+        _client_cache[user.id] = client
+
+    return client
+
+
+def get_rule_engine(user) -> RuleEngine:
+    """Get (or create and cache) the rule engine for a user
+
+    The engine holds the per-rule/per-symbol cooldown map, so it has to
+    outlive a single check for the cooldowns to gate anything.
+    """
+    engine = _engine_cache.get(user.id)
+
+    if engine is None:
+        engine = RuleEngine(get_binance_client(user))
+        _engine_cache[user.id] = engine
+
+    return engine
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     global telegram_bot, scheduler, monitoring_task
     
-    print("🚀 Starting Jarvis MVP...")
+    logger.info("Starting Jarvis MVP...")
     
     # Initialize database
-    init_db()
-    print("✅ Database initialized")
+    await init_db()
+    logger.info("Database initialized")
     
     # Initialize Telegram bot
     telegram_bot = JarvisTelegramBot()
-    print("✅ Telegram bot initialized")
+    logger.info("Telegram bot initialized")
     
     # Initialize scheduler
     scheduler = JarvisScheduler(telegram_bot)
     await scheduler.start()
-    print("✅ Scheduler started")
+    logger.info("Scheduler started")
     
     # Start background monitoring
     monitoring_task = asyncio.create_task(background_monitor())
-    print("✅ Background monitoring started")
+    logger.info("Background monitoring started")
     
     # Start Telegram bot in background
     bot_task = asyncio.create_task(run_telegram_bot())
-    print("✅ Telegram bot running")
+    logger.info("Telegram bot running")
     
-    print("\n" + "="*50)
-    print("🤖 Jarvis is now protecting your trades!")
-    print("="*50 + "\n")
+    logger.info("Jarvis is now protecting your trades!")
     
     yield
     
     # Cleanup
-    print("\n🛑 Shutting down Jarvis...")
+    logger.info("Shutting down Jarvis...")
     scheduler.stop()
     monitoring_task.cancel()
     bot_task.cancel()
-    print("✅ Shutdown complete")
+    for stream in _user_streams.values():
+        await stream.stop()
+    for client in _client_cache.values():
+        await client.close()
+    logger.info("Shutdown complete")
 
 
 # FastAPI app
@@ -85,147 +137,257 @@ app.add_middleware(
 
 
 async def run_telegram_bot():
-    """Run Telegram bot in background"""
+    """
+    Run Telegram bot in background
+
+    With TELEGRAM_WEBHOOK_URL set, Telegram pushes updates straight to
+    the /telegram/webhook endpoint — no getUpdates long-poll round
+    trips. Without it, fall back to polling.
+    """
     try:
         await telegram_bot.app.initialize()
         await telegram_bot.app.start()
-        await telegram_bot.app.updater.start_polling()
+
+        if settings.TELEGRAM_WEBHOOK_URL:
+            await telegram_bot.app.bot.set_webhook(
+                url=settings.TELEGRAM_WEBHOOK_URL,
+                secret_token=settings.TELEGRAM_WEBHOOK_SECRET or None
+            )
+            logger.info("Telegram webhook set: %s", settings.TELEGRAM_WEBHOOK_URL)
+        else:
+            await telegram_bot.app.updater.start_polling()
         
         # Keep running
         while True:
             await asyncio.sleep(1)
     
     except asyncio.CancelledError:
-        print("🛑 Telegram bot stopped")
+        logger.info("Telegram bot stopped")
         await telegram_bot.app.stop()
     except Exception as e:
-        print(f"❌ Telegram bot error: {e}")
+        logger.error("Telegram bot error: %s", e)
+
+
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    """Receive a pushed Telegram update (webhook mode)"""
+    if settings.TELEGRAM_WEBHOOK_SECRET:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+        if token != settings.TELEGRAM_WEBHOOK_SECRET:
+            raise HTTPException(status_code=403, detail="Bad secret token")
+
+    update = Update.de_json(await request.json(), telegram_bot.app.bot)
+    await telegram_bot.app.process_update(update)
+
+    return {"ok": True}
+
+
+async def on_user_stream_event(user_id: int, event: Dict):
+    """
+    React to a pushed account/order update by re-checking the user now
+    """
+    # The event supersedes whatever the account cache holds
+    client = _client_cache.get(user_id)
+    if client:
+        client.invalidate_account_cache()
+
+    try:
+        async with get_db() as db:
+            user = (await db.execute(
+                select(User.id, User.telegram_id,
+                       User.binance_api_key, User.binance_api_secret)
+                .where(User.id == user_id, User.is_active == True)
+            )).first()
+
+        if user:
+            await check_user_positions(user)
+
+    except Exception as e:
+        logger.error("Error handling stream event for user %s: %s", user_id, e)
+
+
+async def ensure_user_stream(user):
+    """
+    Open the user-data stream for a user if it isn't running yet
+    """
+    stream = _user_streams.get(user.id)
+
+    if stream and stream.running:
+        return
+
+    user_id = user.id
+    stream = UserDataStream(
+        get_binance_client(user),
+        lambda event: on_user_stream_event(user_id, event)
+    )
+
+    try:
+        await stream.start()
+        _user_streams[user_id] = stream
+        logger.info("User-data stream opened for user %s", user.telegram_id)
+    except Exception as e:
+        logger.warning("Could not open user stream for %s: %s", user.telegram_id, e)
 
 
 async def background_monitor():
     """
-    Background task: Monitor all users' positions every 15 seconds
+    Background task: Reconcile all users' positions every 15 seconds
+
+    The user-data streams push most changes in real time; this loop keeps
+    streams alive and catches anything the websocket missed.
     """
-    print(f"👀 Monitoring loop started (interval: {settings.POLL_INTERVAL_SECONDS}s)")
-    
+    logger.info("Monitoring loop started (interval: %ss)", POLL_INTERVAL_SECONDS)
+
+    # Cap concurrent checks to stay within Binance rate limits
+    sem = asyncio.Semaphore(MONITOR_CONCURRENCY)
+
+    async def check_one(user):
+        async with sem:
+            try:
+                await ensure_user_stream(user)
+                await check_user_positions(user)
+            except Exception as e:
+                logger.error("Error checking user %s: %s", user.telegram_id, e)
+
     while True:
         try:
-            await asyncio.sleep(settings.POLL_INTERVAL_SECONDS)
-            
-            # Get all active users
-            with get_db_dependency() as db:
-                users = db.query(User).filter(User.is_active == True).all()
-                
-                print(f"\n⏰ [{datetime.utcnow().strftime('%H:%M:%S')}] Checking {len(users)} user(s)...")
-                
-                for user in users:
-                    try:
-                        await check_user_positions(user, db)
-                    except Exception as e:
-                        print(f"❌ Error checking user {user.telegram_id}: {e}")
-        
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+            # Fetch just the columns the checks need, as plain rows —
+            # no ORM objects to hydrate or keep alive across the cycle
+            async with get_db() as db:
+                user_rows = (await db.execute(
+                    select(User.id, User.telegram_id,
+                           User.binance_api_key, User.binance_api_secret)
+                    .where(User.is_active == True)
+                )).all()
+
+            logger.debug("Checking %d user(s)...", len(user_rows))
+
+            # Check all users concurrently; wall time becomes max, not sum
+            await asyncio.gather(*(check_one(user) for user in user_rows))
+
+            # One bulk last_seen touch for the whole cycle
+            if user_rows:
+                async with get_db() as db:
+                    await db.execute(
+                        update(User)
+                        .where(User.id.in_([user.id for user in user_rows]))
+                        .values(last_seen=datetime.utcnow())
+                    )
+
         except asyncio.CancelledError:
-            print("🛑 Monitoring loop stopped")
+            logger.info("Monitoring loop stopped")
             break
         except Exception as e:
-            print(f"❌ Monitoring error: {e}")
+            logger.error("Monitoring error: %s", e)
             await asyncio.sleep(5)
 
 
-async def check_user_positions(user: User, db: Session):
+async def check_user_positions(user):
     """
     Check a single user's positions and send alerts if needed
+
+    `user` only needs id / telegram_id / the API credentials, so the
+    monitor passes narrow rows rather than full User objects.
+
+    Binance and Telegram I/O run without a DB session; short sessions
+    are opened only around the actual writes so pool connections are
+    never pinned across network waits.
     """
+    # Reuse the cached Binance client for this user
+    client = get_binance_client(user)
+
     try:
-        # Initialize Binance client for this user
-        client = BinanceClient(
-            api_key=user.binance_api_key,
-            api_secret=user.binance_api_secret,
-            testnet=settings.BINANCE_TESTNET
-        )
-        
         # Get positions
-        positions = client.get_positions()
-        
+        positions = await client.get_positions()
+
         if not positions:
             return
-        
-        # Initialize rule engine
-        engine = RuleEngine(client)
-        
-        # Check each position
-        for position in positions:
-            alerts = engine.check_all_rules(position)
-            
-            for alert in alerts:
-                # Save alert to database
-                db_alert = Alert(
-                    alert_id=alert['alert_id'],
-                    user_id=user.id,
-                    rule_type=alert['rule_type'],
-                    symbol=alert['symbol'],
-                    side=alert['side'],
-                    position_size=alert['size'],
-                    entry_price=alert['entry_price'],
-                    mark_price=alert['mark_price'],
-                    leverage=alert['leverage'],
-                    risk_pct=alert['risk_pct'],
-                    liq_distance_pct=alert['liq_distance_pct'],
-                    has_stop_loss=alert['has_stop_loss'],
-                    position_snapshot=alert['position_snapshot'],
-                    triggered_at=alert['triggered_at']
+
+        # Reuse the cached rule engine so alert cooldowns persist
+        # across poll ticks and stream events
+        engine = get_rule_engine(user)
+
+        # Collect alerts from all positions, persist in one batch
+        pending = []  # (row dict, alert dict) pairs
+
+        for alert in engine.check_positions(positions):
+            pending.append(({
+                'alert_id': alert['alert_id'],
+                'user_id': user.id,
+                'rule_type': alert['rule_type'],
+                'symbol': alert['symbol'],
+                'side': alert['side'],
+                'position_size': alert['size'],
+                'entry_price': alert['entry_price'],
+                'mark_price': alert['mark_price'],
+                'leverage': alert['leverage'],
+                'risk_pct': alert['risk_pct'],
+                'liq_distance_pct': alert['liq_distance_pct'],
+                'has_stop_loss': alert['has_stop_loss'],
+                'position_snapshot': alert['position_snapshot'],
+                'triggered_at': alert['triggered_at']
+            }, alert))
+
+        # Check revenge pattern
+        revenge_alert = await engine.check_revenge_pattern(user_id=user.id, positions=positions)
+
+        if revenge_alert:
+            pending.append(({
+                'alert_id': revenge_alert['alert_id'],
+                'user_id': user.id,
+                'rule_type': revenge_alert['rule_type'],
+                'symbol': 'SYSTEM',
+                'side': '',
+                'position_size': 0,
+                'entry_price': None,
+                'mark_price': None,
+                'leverage': None,
+                'risk_pct': None,
+                'liq_distance_pct': None,
+                'has_stop_loss': False,
+                'position_snapshot': revenge_alert.get('details', {}),
+                'triggered_at': revenge_alert['triggered_at']
+            }, revenge_alert))
+
+        if pending:
+            # One Core INSERT round trip for the whole batch; RETURNING
+            # hands back the primary keys in parameter order
+            async with get_db() as db:
+                result = await db.execute(
+                    insert(Alert).returning(Alert.id, sort_by_parameter_order=True),
+                    [row for row, _ in pending]
                 )
-                db.add(db_alert)
-                db.commit()
-                
-                # Send Telegram alert
-                message_id = await telegram_bot.send_alert(
+                alert_pks = [pk for (pk,) in result]
+
+            # Queue Telegram alerts with no session held; the bot's
+            # worker pool does the sending, we only wait for the
+            # message IDs once everything is in flight
+            futures = [
+                await telegram_bot.send_alert(
                     telegram_id=user.telegram_id,
                     alert=alert
                 )
-                
+                for _, alert in pending
+            ]
+            message_ids = await asyncio.gather(*futures)
+
+            message_updates = []
+            for alert_pk, message_id, (_, alert) in zip(alert_pks, message_ids, pending):
                 if message_id:
-                    db_alert.telegram_message_id = message_id
-                    db.commit()
-                    
-                    print(f"  🚨 Alert sent: {alert['rule_name']} - {alert['symbol']}")
-        
-        # Check revenge pattern
-        revenge_alert = engine.check_revenge_pattern(user_id=user.id)
-        
-        if revenge_alert:
-            # Save to database
-            db_alert = Alert(
-                alert_id=revenge_alert['alert_id'],
-                user_id=user.id,
-                rule_type=revenge_alert['rule_type'],
-                symbol='SYSTEM',
-                side='',
-                position_size=0,
-                position_snapshot=revenge_alert.get('details', {}),
-                triggered_at=revenge_alert['triggered_at']
-            )
-            db.add(db_alert)
-            db.commit()
-            
-            # Send Telegram alert
-            message_id = await telegram_bot.send_alert(
-                telegram_id=user.telegram_id,
-                alert=revenge_alert
-            )
-            
-            if message_id:
-                db_alert.telegram_message_id = message_id
-                db.commit()
-                
-                print(f"  🧠 Revenge pattern alert sent")
-        
-        # Update user's last_seen
-        user.last_seen = datetime.utcnow()
-        db.commit()
-    
+                    message_updates.append(
+                        {'id': alert_pk, 'telegram_message_id': message_id}
+                    )
+                    logger.info("Alert sent: %s - %s", alert['rule_name'], alert['symbol'])
+
+            # Record message IDs with one executemany UPDATE by primary key
+            if message_updates:
+                async with get_db() as db:
+                    await db.execute(update(Alert), message_updates)
+
     except Exception as e:
-        print(f"  ❌ Error checking user {user.telegram_id}: {e}")
+        logger.error("Error checking user %s: %s", user.telegram_id, e)
 
 
 # ==================== API ENDPOINTS ====================
@@ -263,32 +425,37 @@ async def register_user(
     binance_api_key: str,
     binance_api_secret: str,
     telegram_username: str = None,
-    db: Session = Depends(get_db_dependency)
+    db: AsyncSession = Depends(get_db_dependency)
 ):
     """Register a new user"""
     # Check if user exists
-    existing = db.query(User).filter(User.telegram_id == telegram_id).first()
+    existing = (await db.execute(
+        select(User).where(User.telegram_id == telegram_id)
+    )).scalar_one_or_none()
     
     if existing:
         raise HTTPException(status_code=400, detail="User already registered")
     
     # Validate Binance credentials
+    client = BinanceClient(
+        api_key=binance_api_key,
+        api_secret=binance_api_secret,
+        testnet=settings.BINANCE_TESTNET
+    )
+
     try:
-        client = BinanceClient(
-            api_key=binance_api_key,
-            api_secret=binance_api_secret,
-            testnet=settings.BINANCE_TESTNET
-        )
-        balance = client.get_account_balance()
-        
-        if balance == 0:
-            raise Exception("Invalid API credentials")
-    
+        valid = await client.validate_credentials()
+
     except Exception as e:
         raise HTTPException(
-            status_code=400, 
+            status_code=400,
             detail=f"Invalid Binance API credentials: {str(e)}"
         )
+    finally:
+        await client.close()
+
+    if not valid:
+        raise HTTPException(status_code=400, detail="Invalid Binance API credentials")
     
     # Create user
     user = User(
@@ -301,8 +468,8 @@ async def register_user(
     )
     
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return {
         "success": True,
@@ -315,24 +482,32 @@ async def register_user(
 async def get_user_alerts(
     telegram_id: int,
     limit: int = 50,
-    db: Session = Depends(get_db_dependency)
+    db: AsyncSession = Depends(get_db_dependency)
 ):
     """Get recent alerts for a user"""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = (await db.execute(
+        select(User).where(User.telegram_id == telegram_id)
+    )).scalar_one_or_none()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    alerts = db.query(Alert)\
-        .filter(Alert.user_id == user.id)\
-        .order_by(Alert.triggered_at.desc())\
-        .limit(limit)\
-        .all()
-    
+    alerts = (await db.execute(
+        select(Alert)
+        .where(Alert.user_id == user.id)
+        .order_by(Alert.triggered_at.desc())
+        .limit(limit)
+    )).scalars().all()
+
+    # Full per-user count so clients can paginate past the limited page
+    total_alerts = await db.scalar(
+        select(func.count(Alert.id)).where(Alert.user_id == user.id)
+    )
+
     return {
         "user_id": user.id,
         "telegram_id": telegram_id,
-        "total_alerts": len(alerts),
+        "total_alerts": total_alerts,
         "alerts": [
             {
                 "alert_id": a.alert_id,
@@ -351,16 +526,18 @@ async def get_user_alerts(
 @app.get("/users/{telegram_id}/score")
 async def get_discipline_score(
     telegram_id: int,
-    db: Session = Depends(get_db_dependency)
+    db: AsyncSession = Depends(get_db_dependency)
 ):
     """Get user's discipline score"""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = (await db.execute(
+        select(User).where(User.telegram_id == telegram_id)
+    )).scalar_one_or_none()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Calculate score
-    score = telegram_bot._calculate_discipline_score(user.id, db)
+    # Calculate score (memoized with a short TTL in the bot)
+    score = await telegram_bot._calculate_discipline_score(user.id, db)
     
     from config import get_score_tier
     badge, status = get_score_tier(score)
@@ -377,24 +554,22 @@ async def get_discipline_score(
 @app.get("/users/{telegram_id}/positions")
 async def get_current_positions(
     telegram_id: int,
-    db: Session = Depends(get_db_dependency)
+    db: AsyncSession = Depends(get_db_dependency)
 ):
     """Get user's current Binance positions"""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = (await db.execute(
+        select(User).where(User.telegram_id == telegram_id)
+    )).scalar_one_or_none()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    client = get_binance_client(user)
+
     try:
-        client = BinanceClient(
-            api_key=user.binance_api_key,
-            api_secret=user.binance_api_secret,
-            testnet=settings.BINANCE_TESTNET
-        )
-        
-        positions = client.get_positions()
-        balance = client.get_account_balance()
-        
+        positions = await client.get_positions()
+        balance = await client.get_account_balance()
+
         return {
             "user_id": user.id,
             "telegram_id": telegram_id,
@@ -413,17 +588,20 @@ async def get_current_positions(
 @app.post("/test/alert")
 async def send_test_alert(
     telegram_id: int,
-    db: Session = Depends(get_db_dependency)
+    db: AsyncSession = Depends(get_db_dependency)
 ):
     """Send a test alert"""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = (await db.execute(
+        select(User).where(User.telegram_id == telegram_id)
+    )).scalar_one_or_none()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Create test alert
+    now = datetime.utcnow()
     test_alert = {
-        'alert_id': f'alert_test_{int(datetime.utcnow().timestamp())}',
+        'alert_id': f'alert_test_{int(now.timestamp())}',
         'rule_type': 'high_risk',
         'rule_name': 'High Risk Alert (TEST)',
         'emoji': '⚠️',
@@ -436,14 +614,14 @@ async def send_test_alert(
         'liq_distance_pct': 6.2,
         'leverage': 10,
         'unrealized_pnl': 15.50,
-        'triggered_at': datetime.utcnow()
+        'triggered_at': now
     }
     
-    # Send via Telegram
-    message_id = await telegram_bot.send_alert(
+    # Send via Telegram (send_alert queues; await the future for the ID)
+    message_id = await (await telegram_bot.send_alert(
         telegram_id=telegram_id,
         alert=test_alert
-    )
+    ))
     
     return {
         "success": True,
@@ -453,17 +631,20 @@ async def send_test_alert(
 
 
 @app.get("/stats")
-async def get_stats(db: Session = Depends(get_db_dependency)):
+async def get_stats(db: AsyncSession = Depends(get_db_dependency)):
     """Get overall system statistics"""
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
-    total_alerts = db.query(Alert).count()
-    
-    from datetime import timedelta
+    total_users = await db.scalar(select(func.count(User.id)))
+    active_users = await db.scalar(
+        select(func.count(User.id)).where(User.is_active == True)
+    )
+    total_alerts = await db.scalar(select(func.count(Alert.id)))
+
     today = datetime.utcnow().date()
     today_start = datetime.combine(today, datetime.min.time())
-    
-    alerts_today = db.query(Alert).filter(Alert.triggered_at >= today_start).count()
+
+    alerts_today = await db.scalar(
+        select(func.count(Alert.id)).where(Alert.triggered_at >= today_start)
+    )
     
     return {
         "total_users": total_users,
@@ -475,8 +656,25 @@ async def get_stats(db: Session = Depends(get_db_dependency)):
 
 
 if __name__ == "__main__":
+    import queue
     import uvicorn
-    
+    from logging.handlers import QueueHandler, QueueListener
+
+    # Log records go onto a queue and a background thread does the
+    # actual stdout writes, so the event loop never blocks on I/O
+    _log_queue = queue.Queue(-1)
+    _stream_handler = logging.StreamHandler()
+    _stream_handler.setFormatter(
+        logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s')
+    )
+    _log_listener = QueueListener(_log_queue, _stream_handler)
+    _log_listener.start()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[QueueHandler(_log_queue)]
+    )
+
     print("""
     ╔══════════════════════════════════════╗
     ║                                      ║
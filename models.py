@@ -1,148 +1,178 @@
 """
 Jarvis MVP Database Models
-SQLAlchemy ORM schemas
+SQLAlchemy 2.0 typed ORM schemas
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, JSON, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from typing import Optional
 
-Base = declarative_base()
+from sqlalchemy import DateTime, ForeignKey, Index, JSON, desc
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+
+
+class Base(DeclarativeBase):
+    pass
 
 
 class User(Base):
     """Telegram users with API credentials"""
     __tablename__ = "users"
-    
-    id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False, index=True)
-    telegram_username = Column(String, nullable=True)
-    
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(unique=True, index=True)
+    telegram_username: Mapped[Optional[str]]
+
     # Binance API credentials (encrypted in production!)
-    binance_api_key = Column(String, nullable=False)
-    binance_api_secret = Column(String, nullable=False)
-    
+    binance_api_key: Mapped[str]
+    binance_api_secret: Mapped[str]
+
     # Settings
-    is_active = Column(Boolean, default=True)
-    max_risk_pct = Column(Float, default=2.0)
-    min_liq_distance_pct = Column(Float, default=5.0)
-    
+    is_active: Mapped[bool] = mapped_column(default=True)
+    max_risk_pct: Mapped[float] = mapped_column(default=2.0)
+    min_liq_distance_pct: Mapped[float] = mapped_column(default=5.0)
+
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow)
-    last_seen = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    alerts = relationship("Alert", back_populates="user", cascade="all, delete-orphan")
-    button_clicks = relationship("ButtonClick", back_populates="user", cascade="all, delete-orphan")
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    last_seen: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+    # Relationships — deliberately left lazy: nothing traverses these
+    # collections (recaps and scores aggregate with COUNT queries), so
+    # eager loading would tax every User fetch for no reader
+    alerts: Mapped[list["Alert"]] = relationship(
+        back_populates="user", cascade="all, delete-orphan"
+    )
+    button_clicks: Mapped[list["ButtonClick"]] = relationship(
+        back_populates="user", cascade="all, delete-orphan"
+    )
 
 
 class Alert(Base):
     """Risk alerts sent to users"""
     __tablename__ = "alerts"
-    
-    id = Column(Integer, primary_key=True)
-    alert_id = Column(String, unique=True, nullable=False, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    alert_id: Mapped[str] = mapped_column(unique=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+
     # Alert details
-    rule_type = Column(String, nullable=False)
-    symbol = Column(String, nullable=False)
-    side = Column(String, nullable=False)
-    
+    rule_type: Mapped[str]
+    symbol: Mapped[str]
+    side: Mapped[str]
+
     # Position snapshot
-    position_size = Column(Float, nullable=False)
-    entry_price = Column(Float, nullable=True)
-    mark_price = Column(Float, nullable=True)
-    leverage = Column(Float, nullable=True)
-    
+    position_size: Mapped[float]
+    entry_price: Mapped[Optional[float]]
+    mark_price: Mapped[Optional[float]]
+    leverage: Mapped[Optional[float]]
+
     # Risk metrics
-    risk_pct = Column(Float, nullable=True)
-    liq_distance_pct = Column(Float, nullable=True)
-    has_stop_loss = Column(Boolean, default=False)
-    
+    risk_pct: Mapped[Optional[float]]
+    liq_distance_pct: Mapped[Optional[float]]
+    has_stop_loss: Mapped[bool] = mapped_column(default=False)
+
     # Full position data
-    position_snapshot = Column(JSON, nullable=True)
-    
+    position_snapshot: Mapped[Optional[dict]] = mapped_column(JSON)
+
     # Status
-    is_acknowledged = Column(Boolean, default=False)
-    telegram_message_id = Column(Integer, nullable=True)
-    
+    is_acknowledged: Mapped[bool] = mapped_column(default=False)
+    telegram_message_id: Mapped[Optional[int]]
+
     # Timestamps
-    triggered_at = Column(DateTime, default=datetime.utcnow, index=True)
-    acknowledged_at = Column(DateTime, nullable=True)
-    
+    triggered_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    acknowledged_at: Mapped[Optional[datetime]]
+
     # Relationships
-    user = relationship("User", back_populates="alerts")
-    button_clicks = relationship("ButtonClick", back_populates="alert", cascade="all, delete-orphan")
+    user: Mapped["User"] = relationship(back_populates="alerts")
+    button_clicks: Mapped[list["ButtonClick"]] = relationship(
+        back_populates="alert", cascade="all, delete-orphan"
+    )
+
+    # Serves the per-user "latest alerts" listing as a pure index scan;
+    # the trailing rule_type and is_acknowledged keep the recap GROUP BY
+    # and the discipline-score aggregate index-only too
+    __table_args__ = (
+        Index('ix_alerts_user_triggered', 'user_id', desc('triggered_at'),
+              'rule_type', 'is_acknowledged'),
+    )
 
 
 class ButtonClick(Base):
     """User actions on alert buttons"""
     __tablename__ = "button_clicks"
-    
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    alert_id = Column(Integer, ForeignKey("alerts.id"), nullable=False, index=True)
-    
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    alert_id: Mapped[int] = mapped_column(ForeignKey("alerts.id"), index=True)
+
     # Button action
-    button_type = Column(String, nullable=False)
-    score_impact = Column(Integer, default=0)
-    
+    button_type: Mapped[str]
+    score_impact: Mapped[int] = mapped_column(default=0)
+
     # Timestamp
-    clicked_at = Column(DateTime, default=datetime.utcnow, index=True)
-    
+    clicked_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
     # Relationships
-    user = relationship("User", back_populates="button_clicks")
-    alert = relationship("Alert", back_populates="button_clicks")
+    user: Mapped["User"] = relationship(back_populates="button_clicks")
+    alert: Mapped["Alert"] = relationship(back_populates="button_clicks")
+
+    # Recap/score queries filter on (user_id, clicked_at); the trailing
+    # score_impact makes the positive-actions count index-only
+    __table_args__ = (
+        Index('ix_button_clicks_user_clicked', 'user_id', 'clicked_at', 'score_impact'),
+    )
 
 
 class DisciplineScore(Base):
     """Daily discipline score snapshots"""
     __tablename__ = "discipline_scores"
-    
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+
     # Score data
-    date = Column(DateTime, nullable=False, index=True)
-    score = Column(Float, nullable=False)
-    
+    date: Mapped[datetime] = mapped_column(DateTime, index=True)
+    score: Mapped[float]
+
     # Components
-    total_alerts = Column(Integer, default=0)
-    acknowledged_alerts = Column(Integer, default=0)
-    positive_actions = Column(Integer, default=0)
-    violations = Column(Integer, default=0)
-    
+    total_alerts: Mapped[int] = mapped_column(default=0)
+    acknowledged_alerts: Mapped[int] = mapped_column(default=0)
+    positive_actions: Mapped[int] = mapped_column(default=0)
+    violations: Mapped[int] = mapped_column(default=0)
+
     # Badge
-    badge = Column(String, nullable=True)
-    status = Column(String, nullable=True)
-    
+    badge: Mapped[Optional[str]]
+    status: Mapped[Optional[str]]
+
     # Calculated at
-    calculated_at = Column(DateTime, default=datetime.utcnow)
+    calculated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+    # Score history is always read per user in date order
+    __table_args__ = (
+        Index('ix_discipline_scores_user_date', 'user_id', 'date'),
+    )
 
 
 class Trade(Base):
     """Trade history for revenge pattern detection"""
     __tablename__ = "trades"
-    
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+
     # Trade details
-    symbol = Column(String, nullable=False)
-    side = Column(String, nullable=False)
-    size = Column(Float, nullable=False)
-    entry_price = Column(Float, nullable=False)
-    exit_price = Column(Float, nullable=True)
-    
+    symbol: Mapped[str]
+    side: Mapped[str]
+    size: Mapped[float]
+    entry_price: Mapped[float]
+    exit_price: Mapped[Optional[float]]
+
     # P&L
-    pnl = Column(Float, nullable=True)
-    is_win = Column(Boolean, nullable=True)
-    
+    pnl: Mapped[Optional[float]]
+    is_win: Mapped[Optional[bool]]
+
     # Timestamps
-    opened_at = Column(DateTime, nullable=False, index=True)
-    closed_at = Column(DateTime, nullable=True, index=True)
-    
+    opened_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+    closed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, index=True)
+
     # Metadata
-    leverage = Column(Float, nullable=True)
-    order_id = Column(String, nullable=True)
+    leverage: Mapped[Optional[float]]
+    order_id: Mapped[Optional[str]]
@@ -2,11 +2,54 @@
 Jarvis MVP - Rule Engine
 4 core risk detection rules with alert generation
 """
+import logging
+import secrets
+import time
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from config import settings, RULES
 from binance_client import BinanceClient
 
+logger = logging.getLogger("jarvis.rules")
+
+
+# Every key an alert dict carries; copying this template hands each
+# alert a hash table already sized for all of them
+_ALERT_TEMPLATE = dict.fromkeys((
+    'alert_id', 'rule_type', 'rule_name', 'emoji', 'severity',
+    'message', 'suggestion', 'pattern_type', 'details',
+    'symbol', 'side', 'size', 'entry_price', 'mark_price', 'leverage',
+    'risk_pct', 'liq_distance_pct', 'has_stop_loss', 'unrealized_pnl',
+    'position_snapshot', 'triggered_at',
+))
+
+# (alert key, position key, default) for the fields copied verbatim
+# from a position into every alert
+_POSITION_FIELDS = (
+    ('symbol', 'symbol', ''),
+    ('side', 'side_normalized', ''),
+    ('size', 'size', 0),
+    ('entry_price', 'entry_price', 0),
+    ('mark_price', 'mark_price', 0),
+    ('leverage', 'leverage', 1),
+    ('risk_pct', 'risk_pct', 0),
+    ('liq_distance_pct', 'liq_distance_pct', 0),
+    ('has_stop_loss', 'has_stop_loss', False),
+    ('unrealized_pnl', 'unrealized_pnl', 0),
+)
+
+
+def _size_reduction_pct(current_risk: float, target_risk: float) -> float:
+    """How much of the position to shed to get back under target risk"""
+    return ((current_risk - target_risk) / current_risk) * 100
+
+
+def _suggested_sl_price(entry_price: float, risk_pct: float, is_long: bool) -> float:
+    """Stop-loss price that caps the loss at risk_pct from entry"""
+    if is_long:
+        return entry_price * (1 - risk_pct / 100)
+    return entry_price * (1 + risk_pct / 100)
+
 
 class RuleEngine:
     """
@@ -16,7 +59,18 @@ class RuleEngine:
     
     def __init__(self, binance_client: BinanceClient):
         self.client = binance_client
-        self.last_alert_times = {}  # Track cooldowns per rule
+        self.last_alert_times = {}  # rule:symbol -> monotonic timestamp
+        # Bind config lookups once; these run per position per tick
+        self._rules = dict(RULES)
+        self._cooldowns = dict(settings.ALERT_COOLDOWNS)
+        self._max_risk_pct = settings.MAX_RISK_PCT
+        self._min_liq_distance_pct = settings.MIN_LIQ_DISTANCE_PCT
+        # Per-position rules, dispatched as a tuple in check_all_rules
+        self._checks = (
+            self.check_high_risk,
+            self.check_liquidation_risk,
+            self.check_no_stop_loss,
+        )
     
     def check_all_rules(self, position: Dict) -> List[Dict]:
         """
@@ -25,72 +79,107 @@ class RuleEngine:
         Returns:
             List of alert dicts (empty if no violations)
         """
+        return [
+            alert
+            for alert in (check(position) for check in self._checks)
+            if alert
+        ]
+    
+    def check_positions(self, positions: List[Dict]) -> List[Dict]:
+        """
+        Run the per-position rules over a whole batch of positions
+
+        Screens the whole batch against the thresholds first and only
+        dispatches the full checks for positions that can actually fire,
+        so clean positions cost three comparisons and no method calls.
+
+        Returns:
+            Flattened list of alert dicts across all positions
+        """
         alerts = []
-        
-        # Rule 1: High Risk
-        if alert := self.check_high_risk(position):
-            alerts.append(alert)
-        
-        # Rule 2: Liquidation Risk
-        if alert := self.check_liquidation_risk(position):
-            alerts.append(alert)
-        
-        # Rule 3: No Stop Loss
-        if alert := self.check_no_stop_loss(position):
-            alerts.append(alert)
-        
+        max_risk = self._max_risk_pct
+        min_liq = self._min_liq_distance_pct
+
+        for position in positions:
+            if (position.get('risk_pct', 0) <= max_risk
+                    and position.get('liq_distance_pct', 999) >= min_liq
+                    and position.get('has_stop_loss', False)):
+                continue  # nothing can trigger for this position
+
+            alerts.extend(self.check_all_rules(position))
+
         return alerts
-    
-    def check_revenge_pattern(self, user_id: int) -> Optional[Dict]:
+
+    async def check_revenge_pattern(
+        self,
+        user_id: int,
+        positions: Optional[List[Dict]] = None
+    ) -> Optional[Dict]:
         """
         Rule 4: Revenge Trading Pattern (separate check, not per-position)
         Requires trade history analysis
         
+        Callers that already hold the open positions can pass them in to
+        save a Binance round trip.
+        
         Returns:
             Alert dict if pattern detected, None otherwise
         """
         try:
-            trades = self.client.get_recent_trades(limit=20)
-            
+            now = datetime.utcnow()
+
+            # Both patterns only look at the last half hour, so cap the
+            # history fetch to that window
+            cutoff = now - timedelta(minutes=max(30, settings.REVENGE_WINDOW_MINUTES))
+            trades = await self.client.get_recent_trades(limit=20, since=cutoff)
+
             if len(trades) < 2:
                 return None
             
-            now = datetime.utcnow()
+            # One pass over the trades: compute each age once and bucket
+            # for both patterns; epoch floats keep this to plain
+            # subtraction with no timedelta churn
+            revenge_window_s = settings.REVENGE_WINDOW_MINUTES * 60
+            now_epoch = time.time()
             
-            # Pattern 1: Multiple losses + quick re-entry
-            recent_trades = [
-                t for t in trades 
-                if (now - t['closed_time_dt']).total_seconds() < settings.REVENGE_WINDOW_MINUTES * 60
-            ]
+            recent_count = 0  # closed within the last 30 minutes
+            window_count = 0  # closed within the revenge window
+            losses = []       # losing trades within the revenge window
             
-            if len(recent_trades) >= 2:
-                # Check for losing streak
-                losses = [t for t in recent_trades if not t['is_win']]
+            for t in trades:
+                age = now_epoch - t['closed_epoch']
+                
+                if age < 1800:  # 30 minutes
+                    recent_count += 1
                 
+                if age < revenge_window_s:
+                    window_count += 1
+                    if not t['is_win']:
+                        losses.append(t)
+            
+            # Pattern 1: Multiple losses + quick re-entry
+            if window_count >= 2:
+                # Check for losing streak
                 if len(losses) >= 2:
                     # Check if new position opened within 5 minutes of last loss
-                    last_loss_time = losses[0]['closed_time_dt']
-                    positions = self.client.get_positions()
+                    last_loss_age = now_epoch - losses[0]['closed_epoch']
                     
-                    for pos in positions:
-                        if (now - last_loss_time).total_seconds() < 300:  # 5 minutes
+                    if last_loss_age < 300:  # 5 minutes
+                        if positions is None:
+                            positions = await self.client.get_positions()
+                        
+                        if positions:
                             return self._create_alert(
                                 rule_type='revenge',
-                                position=positions[0] if positions else {},
+                                position=positions[0],
                                 pattern_type='Quick re-entry after losses',
                                 details={
                                     'recent_losses': len(losses),
-                                    'time_since_last_loss': f"{int((now - last_loss_time).total_seconds() / 60)}m"
+                                    'time_since_last_loss': f"{int(last_loss_age / 60)}m"
                                 }
                             )
             
             # Pattern 2: High trade frequency (>5 trades in 30 minutes)
-            thirty_min_ago = now - timedelta(minutes=30)
-            recent_count = len([
-                t for t in trades 
-                if t['closed_time_dt'] > thirty_min_ago
-            ])
-            
             if recent_count >= 5:
                 return self._create_alert(
                     rule_type='revenge',
@@ -105,7 +194,7 @@ class RuleEngine:
             return None
             
         except Exception as e:
-            print(f"⚠️ Error checking revenge pattern: {e}")
+            logger.error("Error checking revenge pattern: %s", e)
             return None
     
     def check_high_risk(self, position: Dict) -> Optional[Dict]:
@@ -116,20 +205,23 @@ class RuleEngine:
         """
         risk_pct = position.get('risk_pct', 0)
         
-        if risk_pct > settings.MAX_RISK_PCT:
+        if not risk_pct:  # empty/closed positions carry no risk
+            return None
+        
+        if risk_pct > self._max_risk_pct:
+            symbol = position['symbol']
+            
             # Check cooldown
-            if not self._should_alert('high_risk', position['symbol']):
+            if not self._should_alert('high_risk', symbol):
                 return None
             
             # Calculate recommended size reduction
-            current_risk = risk_pct
-            target_risk = settings.MAX_RISK_PCT
-            reduction_pct = ((current_risk - target_risk) / current_risk) * 100
+            reduction_pct = _size_reduction_pct(risk_pct, self._max_risk_pct)
             
             return self._create_alert(
                 rule_type='high_risk',
                 position=position,
-                message=f"Risk {risk_pct}% exceeds limit ({settings.MAX_RISK_PCT}%)",
+                message=f"Risk {risk_pct}% exceeds limit ({self._max_risk_pct}%)",
                 suggestion=f"Reduce size by ~{int(reduction_pct)}%",
                 severity='warning'
             )
@@ -144,7 +236,7 @@ class RuleEngine:
         """
         liq_distance = position.get('liq_distance_pct', 999)
         
-        if liq_distance < settings.MIN_LIQ_DISTANCE_PCT:
+        if liq_distance < self._min_liq_distance_pct:
             # Check cooldown
             if not self._should_alert('liq_risk', position['symbol']):
                 return None
@@ -152,7 +244,7 @@ class RuleEngine:
             return self._create_alert(
                 rule_type='liq_risk',
                 position=position,
-                message=f"Liquidation {liq_distance:.1f}% away (min safe: {settings.MIN_LIQ_DISTANCE_PCT}%)",
+                message=f"Liquidation {liq_distance:.1f}% away (min safe: {self._min_liq_distance_pct}%)",
                 suggestion="Add margin or reduce leverage",
                 severity='critical'
             )
@@ -177,16 +269,18 @@ class RuleEngine:
             entry_price = position.get('entry_price', 0)
             side = position.get('side', 'Long')
             
-            if side == 'Long':
-                sl_price = entry_price * (1 - risk_pct / 100)
+            # No entry price means no meaningful SL level to suggest
+            if entry_price == 0:
+                suggestion = ""
             else:
-                sl_price = entry_price * (1 + risk_pct / 100)
-            
+                sl_price = _suggested_sl_price(entry_price, risk_pct, side == 'Long')
+                suggestion = f"Set SL at ${sl_price:,.2f} (~{risk_pct}% risk)"
+
             return self._create_alert(
                 rule_type='no_sl',
                 position=position,
                 message="No stop loss detected",
-                suggestion=f"Set SL at ${sl_price:,.2f} (~{risk_pct}% risk)",
+                suggestion=suggestion,
                 severity='warning'
             )
         
@@ -205,40 +299,34 @@ class RuleEngine:
         """
         Create standardized alert dictionary
         """
-        rule_config = RULES.get(rule_type, {})
-        
-        alert = {
-            'alert_id': self._generate_alert_id(rule_type, position.get('symbol', 'SYSTEM')),
-            'rule_type': rule_type,
-            'rule_name': rule_config.get('name', rule_type),
-            'emoji': rule_config.get('emoji', '⚠️'),
-            'severity': severity,
-            'message': message,
-            'suggestion': suggestion,
-            'pattern_type': pattern_type,
-            'details': details or {},
-            
-            # Position data
-            'symbol': position.get('symbol', ''),
-            'side': position.get('side_normalized', ''),
-            'size': position.get('size', 0),
-            'entry_price': position.get('entry_price', 0),
-            'mark_price': position.get('mark_price', 0),
-            'leverage': position.get('leverage', 1),
-            'risk_pct': position.get('risk_pct', 0),
-            'liq_distance_pct': position.get('liq_distance_pct', 0),
-            'has_stop_loss': position.get('has_stop_loss', False),
-            'unrealized_pnl': position.get('unrealized_pnl', 0),
-            
-            # Full position snapshot
-            'position_snapshot': position,
-            
-            # Timestamp
-            'triggered_at': datetime.utcnow()
-        }
+        rule_config = self._rules.get(rule_type, {})
+        position_get = position.get
+
+        # Copying the pre-sized template skips the rehashes a literal
+        # dict pays while growing past 21 keys
+        alert = _ALERT_TEMPLATE.copy()
+        alert['alert_id'] = self._generate_alert_id(rule_type, position_get('symbol', 'SYSTEM'))
+        alert['rule_type'] = rule_type
+        alert['rule_name'] = rule_config.get('name', rule_type)
+        alert['emoji'] = rule_config.get('emoji', '⚠️')
+        alert['severity'] = severity
+        alert['message'] = message
+        alert['suggestion'] = suggestion
+        alert['pattern_type'] = pattern_type
+        alert['details'] = details or {}
+
+        # Full position snapshot
+        alert['position_snapshot'] = position
+
+        # Timestamp
+        alert['triggered_at'] = datetime.utcnow()
+
+        # Position data, driven by the shared field map
+        for dest, src, default in _POSITION_FIELDS:
+            alert[dest] = position_get(src, default)
         
         # Update last alert time
-        self._update_last_alert_time(rule_type, position.get('symbol', ''))
+        self._update_last_alert_time(rule_type, alert['symbol'])
         
         return alert
     
@@ -250,27 +338,27 @@ class RuleEngine:
             True if should send alert, False if in cooldown
         """
         key = f"{rule_type}:{symbol}"
-        cooldown = settings.ALERT_COOLDOWNS.get(rule_type, 300)
+        cooldown = self._cooldowns.get(rule_type, 300)
         
-        if key in self.last_alert_times:
-            last_time = self.last_alert_times[key]
-            elapsed = (datetime.utcnow() - last_time).total_seconds()
-            
-            if elapsed < cooldown:
-                return False  # Still in cooldown
+        last_time = self.last_alert_times.get(key)
+        
+        if last_time is not None and time.monotonic() - last_time < cooldown:
+            return False  # Still in cooldown
         
         return True
     
     def _update_last_alert_time(self, rule_type: str, symbol: str):
         """Update last alert timestamp for cooldown tracking"""
         key = f"{rule_type}:{symbol}"
-        self.last_alert_times[key] = datetime.utcnow()
+        self.last_alert_times[key] = time.monotonic()
     
     def _generate_alert_id(self, rule_type: str, symbol: str) -> str:
         """
         Generate unique alert ID
         
-        Format: alert_YYYYMMDD_HHMMSS_ruletype_symbol
+        Format: alert_<ms epoch>_ruletype_symbol_<random>
+        
+        The random suffix keeps two alerts for the same rule/symbol in
+        the same instant from colliding on the UNIQUE constraint.
         """
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        return f"alert_{timestamp}_{rule_type}_{symbol}"
+        return f"alert_{int(time.time() * 1000)}_{rule_type}_{symbol}_{secrets.token_hex(3)}"
@@ -3,10 +3,20 @@ Jarvis MVP - Scheduler
 Daily recap and periodic tasks
 """
 import asyncio
-from datetime import datetime, time
+import logging
+from datetime import datetime, time, timedelta
+from sqlalchemy import select
 from database import get_db
 from models import User
 
+logger = logging.getLogger("jarvis.scheduler")
+
+# How many recap sends may be in flight at once
+RECAP_CONCURRENCY = 20
+
+# Users fetched per keyset page during recap fan-out
+RECAP_BATCH_SIZE = 200
+
 
 class JarvisScheduler:
     """Schedule periodic tasks like daily recap"""
@@ -14,11 +24,12 @@ class JarvisScheduler:
     def __init__(self, telegram_bot):
         self.telegram_bot = telegram_bot
         self.running = False
+        self._recap_utc = time(20, 0)  # daily recap trigger, built once
     
     async def start(self):
         """Start all scheduled tasks"""
         self.running = True
-        print("📅 Scheduler started")
+        logger.info("Scheduler started")
         
         # Start daily recap task
         asyncio.create_task(self.daily_recap_loop())
@@ -26,57 +37,94 @@ class JarvisScheduler:
     def stop(self):
         """Stop scheduler"""
         self.running = False
-        print("📅 Scheduler stopped")
+        logger.info("Scheduler stopped")
     
     async def daily_recap_loop(self):
         """
         Send daily recap at 20:00 UTC
-        Runs in a loop, checking every minute
+        Sleeps straight through to the next trigger instead of polling
         """
-        print(f"📊 Daily recap scheduled for 20:00 UTC")
+        logger.info("Daily recap scheduled for 20:00 UTC")
         
         while self.running:
             try:
-                now = datetime.utcnow()
+                await asyncio.sleep(self._seconds_until(self._recap_utc))
                 
-                # Check if it's 20:00 UTC (within 1 minute window)
-                if now.hour == 20 and now.minute == 0:
-                    print(f"\n⏰ Daily recap time! Sending to all users...")
-                    await self.send_daily_recaps()
-                    
-                    # Sleep for 2 minutes to avoid sending multiple times
-                    await asyncio.sleep(120)
-                else:
-                    # Check every minute
-                    await asyncio.sleep(60)
+                if not self.running:
+                    break
+                
+                logger.info("Daily recap time! Sending to all users...")
+                await self.send_daily_recaps()
             
             except Exception as e:
-                print(f"❌ Error in daily recap loop: {e}")
+                logger.error("Error in daily recap loop: %s", e)
                 await asyncio.sleep(60)
     
+    @staticmethod
+    def _seconds_until(target: time) -> float:
+        """Seconds from now until the next occurrence of target (UTC)"""
+        now = datetime.utcnow()
+        next_dt = datetime.combine(now.date(), target)
+        
+        if next_dt <= now:
+            next_dt += timedelta(days=1)
+        
+        return (next_dt - now).total_seconds()
+    
     async def send_daily_recaps(self):
-        """Send daily recap to all active users"""
+        """
+        Send daily recap to all active users
+
+        Users are walked in keyset-paginated batches so memory stays
+        bounded regardless of user count, and each batch query runs in
+        its own short session with no connection held while sending.
+        """
         try:
-            with get_db() as db:
-                users = db.query(User).filter(User.is_active == True).all()
-                
-                print(f"   Sending recap to {len(users)} user(s)...")
-                
-                for user in users:
-                    try:
-                        await self.telegram_bot.send_daily_recap(
-                            telegram_id=user.telegram_id,
-                            user_id=user.id
-                        )
-                        print(f"   ✅ Sent to user {user.telegram_id}")
-                        
-                        # Small delay between sends
-                        await asyncio.sleep(0.5)
-                    
-                    except Exception as e:
-                        print(f"   ❌ Failed for user {user.telegram_id}: {e}")
-                
-                print(f"✅ Daily recap complete!")
-        
+            # Fan the sends out concurrently; the semaphore keeps us
+            # under Telegram's rate limits
+            sem = asyncio.Semaphore(RECAP_CONCURRENCY)
+
+            async def _send(user):
+                async with sem:
+                    await self.telegram_bot.send_daily_recap(
+                        telegram_id=user.telegram_id,
+                        user_id=user.id
+                    )
+
+            sent = 0
+            failures = 0
+            last_id = 0
+
+            while True:
+                async with get_db() as db:
+                    batch = (await db.execute(
+                        select(User.id, User.telegram_id)
+                        .where(User.is_active == True, User.id > last_id)
+                        .order_by(User.id)
+                        .limit(RECAP_BATCH_SIZE)
+                    )).all()
+
+                if not batch:
+                    break
+
+                last_id = batch[-1].id
+                logger.info("Sending recap batch of %d user(s)...", len(batch))
+
+                results = await asyncio.gather(
+                    *(_send(user) for user in batch),
+                    return_exceptions=True
+                )
+
+                for user, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        failures += 1
+                        logger.warning("Recap failed for user %s: %s", user.telegram_id, result)
+                    else:
+                        sent += 1
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Recap sent to user %s", user.telegram_id)
+
+            logger.info("Daily recap complete (%d sent, %d failed)", sent, failures)
+
         except Exception as e:
-            print(f"❌ Error sending daily recaps: {e}")
+            logger.error("Error sending daily recaps: %s", e)
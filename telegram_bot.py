@@ -2,23 +2,239 @@
 Jarvis MVP - Telegram Bot
 Send alerts with action buttons and handle user interactions
 """
+import asyncio
+import html
+import logging
+from aiolimiter import AsyncLimiter
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from telegram.constants import ParseMode
-from typing import Dict, List
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+from sqlalchemy import select, func, case, literal, null
+from sqlalchemy import update as sql_update
+from typing import Dict, List, Optional
 from datetime import datetime
 from config import settings, BUTTON_CONFIGS, get_score_tier, RULES
 from database import get_db
 from models import User, Alert, ButtonClick, DisciplineScore
-import json
+import time
+
+# Compact callback payloads: one-letter action codes keep callback_data
+# well inside Telegram's 64-byte budget with no JSON on either side
+_ACTION_CODE = {
+    'ack': 'a',
+    'cooldown': 'c',
+    'reduce': 'r',
+    'set_sl': 's',
+    'add_margin': 'm',
+    'view_stats': 'v',
+}
+_CODE_ACTION = {code: action for action, code in _ACTION_CODE.items()}
+
+logger = logging.getLogger("jarvis.bot")
+
+# Static message bodies, built once at import
+_WELCOME_TEMPLATE = """
+🤖 <b>Jarvis Risk Monitor</b>
+
+Hey {first_name}! I'm your trading guardian angel.
+
+I'll monitor your Binance Futures positions 24/7 and alert you when:
+⚠️ Risk exceeds {max_risk}%
+🔴 Liquidation gets too close
+🛡️ You forget to set stop loss
+🧠 Revenge trading patterns detected
+
+<b>Quick Commands:</b>
+/status - Check current positions
+/score - View discipline score
+/help - Get help
+
+Ready to protect your capital! 🚀
+        """
+
+_HELP_MSG = """
+🆘 <b>Jarvis Help</b>
+
+<b>How It Works:</b>
+I monitor your Binance Futures positions every 15 seconds and alert you when risks are detected.
+
+<b>Alert Types:</b>
+⚠️ <b>High Risk</b> - Position risk exceeds limit
+🔴 <b>Liquidation Risk</b> - Too close to liquidation
+🛡️ <b>No Stop Loss</b> - Missing stop loss protection
+🧠 <b>Revenge Pattern</b> - Emotional trading detected
+
+<b>Action Buttons:</b>
+✅ Acknowledge - Mark alert as seen
+🧊 Cooldown 30m - Take a break (+5 points)
+📉 Reduce size - Commit to reducing risk (+3 points)
+🛡️ Setting SL - Commit to adding stop loss (+5 points)
+
+<b>Your Score:</b>
+Higher discipline scores mean better trading habits. Take positive actions to improve!
+
+<b>Commands:</b>
+/status - Current positions
+/score - Discipline score
+/help - This message
+
+Questions? Just ask! 💬
+        """
+
+# Default buttons per rule type
+_BUTTON_MAP = {
+    'high_risk': ['ack', 'reduce', 'cooldown'],
+    'liq_risk': ['ack', 'add_margin', 'reduce'],
+    'no_sl': ['ack', 'set_sl', 'cooldown'],
+    'revenge': ['ack', 'cooldown', 'view_stats']
+}
+
+# Confirmation templates per button action ({score_impact} filled below)
+_ACTION_RESPONSE_TEMPLATES = {
+    'ack': "✅ Acknowledged",
+    'cooldown': "🧊 Great decision! Taking a 30-minute break. (+{score_impact} points)",
+    'reduce': "📉 Smart move! Committing to reduce risk. (+{score_impact} points)",
+    'set_sl': "🛡️ Excellent! Setting stop loss is key. (+{score_impact} points)",
+    'add_margin': "💰 Good call! Adding margin for safety. (+{score_impact} points)",
+    'view_stats': "📊 Opening stats..."
+}
+
+# Score impacts are fixed in BUTTON_CONFIGS, so the confirmations can
+# be rendered once at import; each click is then a single dict lookup
+_ACTION_RESPONSES = {
+    action: template.format(
+        score_impact=BUTTON_CONFIGS.get(action, {}).get('score', 0)
+    )
+    for action, template in _ACTION_RESPONSE_TEMPLATES.items()
+}
+
+# Recap focus suggestion per top violation
+_RECAP_SUGGESTIONS = {
+    'high_risk': 'Size your positions more conservatively',
+    'liq_risk': 'Use lower leverage to stay safe',
+    'no_sl': 'Always set stop loss immediately',
+    'revenge': 'Take breaks between trades'
+}
+
+# Discipline scores change only when new alerts or button clicks land,
+# so repeat lookups within the TTL can skip the aggregate query
+_score_cache: Dict[int, tuple] = {}  # user_id -> (expires_at, score)
+SCORE_CACHE_TTL = 120.0
+
+# telegram_id -> (expires_at, user_id); the mapping never changes for a
+# registered user, so interactions skip one SELECT each
+_user_id_cache: Dict[int, tuple] = {}
+USER_CACHE_TTL = 3600.0
+
+# Outbound alert queue sizing: enough workers to keep the rate limiter
+# saturated, a bounded queue so a Telegram outage cannot grow unchecked
+SEND_WORKERS = 8
+SEND_QUEUE_SIZE = 1000
 
 
 class JarvisTelegramBot:
     """Telegram bot for sending alerts and handling user actions"""
     
     def __init__(self):
-        self.app = Application.builder().token(settings.TELEGRAM_BOT_TOKEN).build()
+        # One persistent connection pool for all outbound Telegram calls
+        # (alerts, recaps, replies) so TLS handshakes are paid once, plus
+        # a small separate pool for getUpdates long polling
+        self.app = (
+            Application.builder()
+            .token(settings.TELEGRAM_BOT_TOKEN)
+            .request(HTTPXRequest(
+                connection_pool_size=64,
+                connect_timeout=5.0,
+                pool_timeout=5.0
+            ))
+            .get_updates_request(HTTPXRequest(connection_pool_size=2))
+            .build()
+        )
         self._setup_handlers()
+        # Only the first name varies per /start; bake the risk limit in now
+        self._welcome_tmpl = _WELCOME_TEMPLATE.format(
+            max_risk=settings.MAX_RISK_PCT,
+            first_name='{first_name}'
+        )
+        # (label, action code) rows per rule type; per alert only the
+        # callback suffix changes
+        self._keyboard_shapes = {
+            rule_type: self._build_shape(buttons)
+            for rule_type, buttons in _BUTTON_MAP.items()
+        }
+        self._default_shape = self._build_shape(['ack', 'cooldown', 'reduce'])
+        # Stay under Telegram's hard caps (30 msg/s global, 1 msg/s per
+        # chat) instead of eating 429 retry-after backoffs
+        self._global_limiter = AsyncLimiter(28, 1)
+        self._chat_limiters: Dict[int, AsyncLimiter] = {}
+        # Alert sends are decoupled from the scan loop via a bounded
+        # queue drained by worker tasks; started lazily so __init__
+        # needs no running event loop
+        self._send_queue: Optional[asyncio.Queue] = None
+        self._send_workers: List[asyncio.Task] = []
+    
+    def _ensure_send_workers(self):
+        """Start the send queue and its worker tasks on first use"""
+        if self._send_queue is None:
+            self._send_queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+            self._send_workers = [
+                asyncio.create_task(self._send_worker())
+                for _ in range(SEND_WORKERS)
+            ]
+    
+    async def _send_worker(self):
+        """Drain queued alert sends through the rate limiters"""
+        while True:
+            telegram_id, message, keyboard, future = await self._send_queue.get()
+            
+            try:
+                sent_message = await self._send_message(
+                    chat_id=telegram_id,
+                    text=message,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=keyboard
+                )
+                
+                if not future.done():
+                    future.set_result(sent_message.message_id)
+            
+            except Exception as e:
+                logger.error("Error sending alert to %s: %s", telegram_id, e)
+                if not future.done():
+                    future.set_result(None)
+            
+            finally:
+                self._send_queue.task_done()
+    
+    def _chat_limiter(self, chat_id: int) -> AsyncLimiter:
+        """Get (or create) the per-chat rate limiter"""
+        limiter = self._chat_limiters.get(chat_id)
+        
+        if limiter is None:
+            limiter = self._chat_limiters[chat_id] = AsyncLimiter(1, 1)
+        
+        return limiter
+    
+    async def _send_message(self, chat_id: int, **kwargs):
+        """Send a message under the global and per-chat rate limits"""
+        async with self._global_limiter, self._chat_limiter(chat_id):
+            try:
+                return await self.app.bot.send_message(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                # Last resort if Telegram still pushes back
+                await asyncio.sleep(e.retry_after)
+                return await self.app.bot.send_message(chat_id=chat_id, **kwargs)
+    
+    @staticmethod
+    def _build_shape(button_types: List[str]) -> List[tuple]:
+        """Resolve button types to (label, action code) pairs once"""
+        return [
+            (BUTTON_CONFIGS[b]['label'], _ACTION_CODE[b])
+            for b in button_types
+            if b in BUTTON_CONFIGS
+        ]
     
     def _setup_handlers(self):
         """Register command and callback handlers"""
@@ -35,28 +251,9 @@ class JarvisTelegramBot:
         """Handle /start command"""
         user = update.effective_user
         
-        welcome_msg = f"""
-🤖 **Jarvis Risk Monitor**
-
-Hey {user.first_name}! I'm your trading guardian angel.
-
-I'll monitor your Binance Futures positions 24/7 and alert you when:
-⚠️ Risk exceeds {settings.MAX_RISK_PCT}%
-🔴 Liquidation gets too close
-🛡️ You forget to set stop loss
-🧠 Revenge trading patterns detected
-
-**Quick Commands:**
-/status - Check current positions
-/score - View discipline score
-/help - Get help
-
-Ready to protect your capital! 🚀
-        """
-        
         await update.message.reply_text(
-            welcome_msg,
-            parse_mode=ParseMode.MARKDOWN
+            self._welcome_tmpl.format(first_name=html.escape(user.first_name)),
+            parse_mode=ParseMode.HTML
         )
     
     async def cmd_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -71,27 +268,27 @@ Ready to protect your capital! 🚀
         telegram_id = update.effective_user.id
         
         try:
-            with get_db() as db:
-                user = db.query(User).filter(User.telegram_id == telegram_id).first()
-                
-                if not user:
+            async with get_db() as db:
+                user_id = await self._resolve_user_id(telegram_id, db)
+
+                if user_id is None:
                     await update.message.reply_text(
                         "❌ User not found. Please register first with /start"
                     )
                     return
-                
+
                 # Calculate current score
-                score = self._calculate_discipline_score(user.id, db)
+                score = await self._calculate_discipline_score(user_id, db)
                 badge, status = get_score_tier(score)
                 
                 score_msg = f"""
-📊 **Discipline Score**
+📊 <b>Discipline Score</b>
 
-{badge} **{score:.0f}/100** - {status}
+{badge} <b>{score:.0f}/100</b> - {status}
 
 🎯 Keep it up! Higher scores unlock better insights.
 
-_Score updates daily based on:_
+<i>Score updates daily based on:</i>
 • Alert acknowledgments
 • Positive actions taken
 • Rule violations avoided
@@ -99,47 +296,18 @@ _Score updates daily based on:_
                 
                 await update.message.reply_text(
                     score_msg,
-                    parse_mode=ParseMode.MARKDOWN
+                    parse_mode=ParseMode.HTML
                 )
         
         except Exception as e:
-            print(f"❌ Error in /score command: {e}")
+            logger.error("Error in /score command: %s", e)
             await update.message.reply_text("⚠️ Error fetching score. Try again later.")
     
     async def cmd_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show help message"""
-        help_msg = """
-🆘 **Jarvis Help**
-
-**How It Works:**
-I monitor your Binance Futures positions every 15 seconds and alert you when risks are detected.
-
-**Alert Types:**
-⚠️ **High Risk** - Position risk exceeds limit
-🔴 **Liquidation Risk** - Too close to liquidation
-🛡️ **No Stop Loss** - Missing stop loss protection
-🧠 **Revenge Pattern** - Emotional trading detected
-
-**Action Buttons:**
-✅ Acknowledge - Mark alert as seen
-🧊 Cooldown 30m - Take a break (+5 points)
-📉 Reduce size - Commit to reducing risk (+3 points)
-🛡️ Setting SL - Commit to adding stop loss (+5 points)
-
-**Your Score:**
-Higher discipline scores mean better trading habits. Take positive actions to improve!
-
-**Commands:**
-/status - Current positions
-/score - Discipline score
-/help - This message
-
-Questions? Just ask! 💬
-        """
-        
         await update.message.reply_text(
-            help_msg,
-            parse_mode=ParseMode.MARKDOWN
+            _HELP_MSG,
+            parse_mode=ParseMode.HTML
         )
     
     async def send_alert(
@@ -147,9 +315,12 @@ Questions? Just ask! 💬
         telegram_id: int, 
         alert: Dict,
         buttons: List[str] = None
-    ) -> int:
+    ) -> "asyncio.Future":
         """
-        Send risk alert to user with action buttons
+        Queue a risk alert for sending with action buttons
+        
+        The actual Telegram call happens on a worker task, so a slow
+        send never stalls the caller's scan loop.
         
         Args:
             telegram_id: User's Telegram ID
@@ -157,31 +328,25 @@ Questions? Just ask! 💬
             buttons: List of button types to show
         
         Returns:
-            Message ID of sent message
+            Future resolving to the message ID (None if the send failed)
         """
-        try:
-            # Format alert message
-            message = self._format_alert_message(alert)
-            
-            # Create inline keyboard
-            if buttons is None:
-                buttons = self._get_default_buttons(alert['rule_type'])
-            
+        self._ensure_send_workers()
+        
+        # Format alert message
+        message = self._format_alert_message(alert)
+        
+        # Create inline keyboard from the prebuilt shape; explicit
+        # button lists still go through _create_keyboard
+        if buttons is None:
+            shape = self._keyboard_shapes.get(alert['rule_type'], self._default_shape)
+            keyboard = self._keyboard_from_shape(shape, alert['alert_id'])
+        else:
             keyboard = self._create_keyboard(alert['alert_id'], buttons)
-            
-            # Send message
-            sent_message = await self.app.bot.send_message(
-                chat_id=telegram_id,
-                text=message,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=keyboard
-            )
-            
-            return sent_message.message_id
         
-        except Exception as e:
-            print(f"❌ Error sending alert to {telegram_id}: {e}")
-            return None
+        future = asyncio.get_running_loop().create_future()
+        await self._send_queue.put((telegram_id, message, keyboard, future))
+        
+        return future
     
     def _format_alert_message(self, alert: Dict) -> str:
         """Format alert as Telegram message"""
@@ -193,47 +358,57 @@ Questions? Just ask! 💬
         message = alert.get('message', '')
         suggestion = alert.get('suggestion', '')
         
-        # Build message
-        msg = f"{emoji} **Jarvis Advisory**\n\n"
+        # Build the message as parts joined once at the end, so the
+        # conditional sections never re-allocate a growing string;
+        # user-influenced fields are escaped once so odd symbols can
+        # never break the HTML parse
+        symbol = html.escape(symbol)
+        side = html.escape(side)
+        
+        parts = [f"{emoji} <b>Jarvis Advisory</b>\n\n"]
         
         if symbol:
-            msg += f"**{symbol}** • {side} • {size:.4f}\n"
+            parts.append(f"<b>{symbol}</b> • {side} • {size:.4f}\n")
         
-        msg += f"**{rule_name}**\n"
-        msg += f"{message}\n\n"
+        parts.append(f"<b>{rule_name}</b>\n{message}\n\n")
         
         if suggestion:
-            msg += f"💡 **Suggestion:**\n{suggestion}\n\n"
+            parts.append(f"💡 <b>Suggestion:</b>\n{suggestion}\n\n")
         
-        # Add position details
+        # Position details
         if alert.get('risk_pct'):
-            msg += f"📊 Risk: {alert['risk_pct']:.1f}%\n"
+            parts.append(f"📊 Risk: {alert['risk_pct']:.1f}%\n")
         
         if alert.get('liq_distance_pct'):
-            msg += f"🎯 Liq Distance: {alert['liq_distance_pct']:.1f}%\n"
+            parts.append(f"🎯 Liq Distance: {alert['liq_distance_pct']:.1f}%\n")
         
         if alert.get('leverage'):
-            msg += f"⚡ Leverage: {alert['leverage']}x\n"
+            parts.append(f"⚡ Leverage: {alert['leverage']}x\n")
         
         if alert.get('unrealized_pnl'):
             pnl = alert['unrealized_pnl']
             pnl_emoji = "📈" if pnl > 0 else "📉"
-            msg += f"{pnl_emoji} Unrealized P&L: ${pnl:.2f}\n"
+            parts.append(f"{pnl_emoji} Unrealized P&L: ${pnl:.2f}\n")
         
-        msg += f"\n_Alert ID: {alert['alert_id'][-8:]}_"
+        parts.append(f"\n<i>Alert ID: {alert['alert_id'][-8:]}</i>")
         
-        return msg
+        return ''.join(parts)
     
     def _get_default_buttons(self, rule_type: str) -> List[str]:
         """Get default button configuration for each rule type"""
-        button_map = {
-            'high_risk': ['ack', 'reduce', 'cooldown'],
-            'liq_risk': ['ack', 'add_margin', 'reduce'],
-            'no_sl': ['ack', 'set_sl', 'cooldown'],
-            'revenge': ['ack', 'cooldown', 'view_stats']
-        }
+        return _BUTTON_MAP.get(rule_type, ['ack', 'cooldown', 'reduce'])
+    
+    def _keyboard_from_shape(self, shape: List[tuple], alert_id: str) -> InlineKeyboardMarkup:
+        """Materialize a cached keyboard shape for one alert"""
+        buttons = [
+            InlineKeyboardButton(text=label, callback_data=f"{code}|{alert_id}")
+            for label, code in shape
+        ]
+        
+        # Arrange buttons in rows (2 per row)
+        keyboard = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
         
-        return button_map.get(rule_type, ['ack', 'cooldown', 'reduce'])
+        return InlineKeyboardMarkup(keyboard)
     
     def _create_keyboard(self, alert_id: str, button_types: List[str]) -> InlineKeyboardMarkup:
         """Create inline keyboard with action buttons"""
@@ -242,15 +417,11 @@ Questions? Just ask! 💬
         for btn_type in button_types:
             if btn_type in BUTTON_CONFIGS:
                 config = BUTTON_CONFIGS[btn_type]
-                callback_data = json.dumps({
-                    'action': btn_type,
-                    'alert_id': alert_id
-                })
                 
                 buttons.append(
                     InlineKeyboardButton(
                         text=config['label'],
-                        callback_data=callback_data
+                        callback_data=f"{_ACTION_CODE[btn_type]}|{alert_id}"
                     )
                 )
         
@@ -262,107 +433,137 @@ Questions? Just ask! 💬
     async def handle_button_click(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle action button clicks"""
         query = update.callback_query
-        await query.answer()
         
         try:
-            # Parse callback data
-            data = json.loads(query.data)
-            action = data['action']
-            alert_id = data['alert_id']
+            # Parse packed callback data: "<action code>|<alert_id>"
+            code, alert_id = query.data.split('|', 1)
+            action = _CODE_ACTION[code]
             
             telegram_id = update.effective_user.id
             
             # Save to database
-            with get_db() as db:
-                user = db.query(User).filter(User.telegram_id == telegram_id).first()
-                
-                if not user:
-                    await query.edit_message_text("❌ User not found")
-                    return
-                
-                # Find alert
-                alert = db.query(Alert).filter(Alert.alert_id == alert_id).first()
-                
-                if not alert:
-                    await query.edit_message_text("❌ Alert not found")
+            async with get_db() as db:
+                user_id = await self._resolve_user_id(telegram_id, db)
+
+                if user_id is None:
+                    await query.answer(text="❌ User not found", show_alert=True)
                     return
-                
-                # Record button click
+
                 button_config = BUTTON_CONFIGS.get(action, {})
                 score_impact = button_config.get('score', 0)
                 
-                click = ButtonClick(
-                    user_id=user.id,
-                    alert_id=alert.id,
-                    button_type=action,
-                    score_impact=score_impact,
-                    clicked_at=datetime.utcnow()
-                )
-                db.add(click)
-                
-                # Mark alert as acknowledged
-                if not alert.is_acknowledged:
-                    alert.is_acknowledged = True
-                    alert.acknowledged_at = datetime.utcnow()
+                # Acknowledge with a single guarded UPDATE instead of
+                # reading the row back first; RETURNING hands us the
+                # primary key for the click record
+                alert_pk = (await db.execute(
+                    sql_update(Alert)
+                    .where(Alert.alert_id == alert_id, Alert.is_acknowledged == False)
+                    .values(is_acknowledged=True, acknowledged_at=func.now())
+                    .returning(Alert.id)
+                )).scalar()
                 
-                db.commit()
-                
-                # Send confirmation
-                response_msg = self._get_action_response(action, alert, score_impact)
+                if alert_pk is None:
+                    # Already acknowledged, or the alert never existed;
+                    # one indexed point read settles which
+                    alert_pk = await db.scalar(
+                        select(Alert.id).where(Alert.alert_id == alert_id)
+                    )
+                    
+                    if alert_pk is None:
+                        await query.answer(text="❌ Alert not found", show_alert=True)
+                        return
                 
-                await query.edit_message_text(
-                    text=f"{query.message.text}\n\n{response_msg}",
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                # Plain acks carry no score; skip the ButtonClick INSERT
+                # for them — only scoring actions need the audit row
+                if score_impact:
+                    # clicked_at comes from the column default; no
+                    # per-click utcnow() here
+                    db.add(ButtonClick(
+                        user_id=user_id,
+                        alert_id=alert_pk,
+                        button_type=action,
+                        score_impact=score_impact
+                    ))
+
+                await db.commit()
+
+                # The click changes the score inputs; drop the cached value
+                _score_cache.pop(user_id, None)
+
+                response_msg = self._get_action_response(action)
+
+            # Confirm via the callback answer toast and just clear the
+            # buttons in place — the original alert text never crosses
+            # the wire again, and no session is held for either call
+            await query.answer(text=response_msg, show_alert=False)
+            await query.edit_message_reply_markup(reply_markup=None)
         
         except Exception as e:
-            print(f"❌ Error handling button click: {e}")
-            await query.edit_message_text("⚠️ Error processing action")
+            logger.error("Error handling button click: %s", e)
+            try:
+                await query.answer(text="⚠️ Error processing action", show_alert=True)
+            except Exception:
+                pass  # the callback query may have expired already
     
-    def _get_action_response(self, action: str, alert: Alert, score_impact: int) -> str:
-        """Get response message for button action"""
-        responses = {
-            'ack': "✅ Acknowledged",
-            'cooldown': f"🧊 Great decision! Taking a 30-minute break. (+{score_impact} points)",
-            'reduce': f"📉 Smart move! Committing to reduce risk. (+{score_impact} points)",
-            'set_sl': f"🛡️ Excellent! Setting stop loss is key. (+{score_impact} points)",
-            'add_margin': f"💰 Good call! Adding margin for safety. (+{score_impact} points)",
-            'view_stats': "📊 Opening stats..."
-        }
-        
-        return responses.get(action, "✅ Action recorded")
+    def _get_action_response(self, action: str) -> str:
+        """Get the prerendered response message for a button action"""
+        return _ACTION_RESPONSES.get(action, "✅ Action recorded")
     
-    def _calculate_discipline_score(self, user_id: int, db) -> float:
+    async def _resolve_user_id(self, telegram_id: int, db) -> Optional[int]:
+        """Map a telegram_id to our user id, cached for an hour"""
+        cached = _user_id_cache.get(telegram_id)
+        if cached and time.monotonic() < cached[0]:
+            return cached[1]
+
+        user_id = await db.scalar(
+            select(User.id).where(User.telegram_id == telegram_id)
+        )
+
+        if user_id is not None:
+            _user_id_cache[telegram_id] = (time.monotonic() + USER_CACHE_TTL, user_id)
+
+        return user_id
+
+    async def _calculate_discipline_score(self, user_id: int, db) -> float:
         """
-        Calculate discipline score for user
-        
+        Calculate discipline score for user (memoized with a short TTL)
+
         Formula: 100 - (violations * 5) + (positive_actions * 2)
         """
         from datetime import timedelta
-        
+
+        cached = _score_cache.get(user_id)
+        if cached and time.monotonic() < cached[0]:
+            return cached[1]
+
         # Last 7 days
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        
-        # Count alerts (violations)
-        total_alerts = db.query(Alert).filter(
-            Alert.user_id == user_id,
-            Alert.triggered_at >= seven_days_ago
-        ).count()
-        
-        # Count acknowledged alerts
-        ack_alerts = db.query(Alert).filter(
-            Alert.user_id == user_id,
-            Alert.triggered_at >= seven_days_ago,
-            Alert.is_acknowledged == True
-        ).count()
-        
-        # Count positive actions (score > 0)
-        positive_actions = db.query(ButtonClick).join(Alert).filter(
-            ButtonClick.user_id == user_id,
-            ButtonClick.clicked_at >= seven_days_ago,
-            ButtonClick.score_impact > 0
-        ).count()
-        
+
+        # Positive actions (score > 0) as a scalar subquery so the whole
+        # score needs a single round trip
+        positive_sq = (
+            select(func.count(ButtonClick.id))
+            .where(
+                ButtonClick.user_id == user_id,
+                ButtonClick.clicked_at >= seven_days_ago,
+                ButtonClick.score_impact > 0
+            )
+            .scalar_subquery()
+        )
+
+        # Total alerts, acknowledged alerts and positive actions in one
+        # conditionally-aggregated query
+        total_alerts, ack_alerts, positive_actions = (await db.execute(
+            select(
+                func.count(Alert.id),
+                func.coalesce(func.sum(case((Alert.is_acknowledged, 1), else_=0)), 0),
+                positive_sq
+            ).where(
+                Alert.user_id == user_id,
+                Alert.triggered_at >= seven_days_ago
+            )
+        )).one()
+
         # Calculate violations (alerts not acknowledged)
         violations = total_alerts - ack_alerts
         
@@ -371,84 +572,105 @@ Questions? Just ask! 💬
         
         # Clamp between 0-100
         score = max(0, min(100, score))
-        
+
+        _score_cache[user_id] = (time.monotonic() + SCORE_CACHE_TTL, score)
+
         return score
     
     async def send_daily_recap(self, telegram_id: int, user_id: int):
         """Send daily recap to user"""
         try:
-            with get_db() as db:
+            async with get_db() as db:
                 # Get today's stats
                 today = datetime.utcnow().date()
                 today_start = datetime.combine(today, datetime.min.time())
-                
-                alerts_today = db.query(Alert).filter(
+
+                # Totals and top-3 violations fused into one UNION ALL
+                # round trip; rows are tagged and dispatched by kind
+                totals_q = select(
+                    literal('totals').label('kind'),
+                    func.count(Alert.id).label('n'),
+                    func.coalesce(func.sum(case((Alert.is_acknowledged, 1), else_=0)), 0).label('ack'),
+                    null().label('rule_type')
+                ).where(
                     Alert.user_id == user_id,
                     Alert.triggered_at >= today_start
-                ).all()
+                )
+                
+                top_rules_sq = (
+                    select(
+                        literal('rule').label('kind'),
+                        func.count(Alert.id).label('n'),
+                        literal(0).label('ack'),
+                        Alert.rule_type.label('rule_type')
+                    )
+                    .where(
+                        Alert.user_id == user_id,
+                        Alert.triggered_at >= today_start
+                    )
+                    .group_by(Alert.rule_type)
+                    .order_by(func.count(Alert.id).desc())
+                    .limit(3)
+                    .subquery()
+                )
+                
+                rows = (await db.execute(
+                    totals_q.union_all(select(top_rules_sq))
+                )).all()
                 
-                total_alerts = len(alerts_today)
-                ack_count = sum(1 for a in alerts_today if a.is_acknowledged)
+                total_alerts = ack_count = 0
+                rule_rows = []
                 
-                # Count by rule type
-                rule_counts = {}
-                for alert in alerts_today:
-                    rule_type = alert.rule_type
-                    rule_counts[rule_type] = rule_counts.get(rule_type, 0) + 1
+                for row in rows:
+                    if row.kind == 'totals':
+                        total_alerts, ack_count = row.n, row.ack
+                    else:
+                        rule_rows.append((row.rule_type, row.n))
                 
-                # Get top 3 violations
-                top_violations = sorted(
-                    rule_counts.items(),
-                    key=lambda x: x[1],
-                    reverse=True
-                )[:3]
+                # UNION ALL does not guarantee arm ordering; re-rank the
+                # (at most three) rule rows here
+                top_violations = sorted(rule_rows, key=lambda r: r[1], reverse=True)
                 
                 # Calculate score
-                score = self._calculate_discipline_score(user_id, db)
+                score = await self._calculate_discipline_score(user_id, db)
                 badge, status = get_score_tier(score)
                 
-                # Build recap message
-                recap_msg = f"""
-📊 **Daily Trading Summary**
+                # Build the recap as parts joined once at the end
+                parts = [f"""
+📊 <b>Daily Trading Summary</b>
 
-**{today.strftime('%A, %B %d, %Y')}**
+<b>{today.strftime('%A, %B %d, %Y')}</b>
 
 Alerts sent: {total_alerts}
 Acknowledged: {ack_count}/{total_alerts}
 
-"""
+"""]
                 
                 if top_violations:
-                    recap_msg += "⚠️ **Top Violations:**\n"
+                    parts.append("⚠️ <b>Top Violations:</b>\n")
                     for i, (rule, count) in enumerate(top_violations, 1):
                         rule_name = RULES.get(rule, {}).get('name', rule)
-                        recap_msg += f"{i}. {rule_name} - {count}x\n"
-                    recap_msg += "\n"
+                        parts.append(f"{i}. {rule_name} - {count}x\n")
+                    parts.append("\n")
                 
-                recap_msg += f"""
-🎯 **Discipline Score:** {badge} {score:.0f}/100
+                parts.append(f"""
+🎯 <b>Discipline Score:</b> {badge} {score:.0f}/100
 
-💡 **Focus Tomorrow:**
-"""
+💡 <b>Focus Tomorrow:</b>
+""")
                 
                 # Suggestion based on top violation
                 if top_violations:
                     top_rule = top_violations[0][0]
-                    suggestions = {
-                        'high_risk': 'Size your positions more conservatively',
-                        'liq_risk': 'Use lower leverage to stay safe',
-                        'no_sl': 'Always set stop loss immediately',
-                        'revenge': 'Take breaks between trades'
-                    }
-                    recap_msg += suggestions.get(top_rule, 'Keep following your rules!')
+                    parts.append(_RECAP_SUGGESTIONS.get(top_rule, 'Keep following your rules!'))
                 else:
-                    recap_msg += "Keep up the excellent discipline! 🏆"
+                    parts.append("Keep up the excellent discipline! 🏆")
                 
-                await self.app.bot.send_message(
+                await self._send_message(
                     chat_id=telegram_id,
-                    text=recap_msg,
-                    parse_mode=ParseMode.MARKDOWN
+                    text=''.join(parts),
+                    parse_mode=ParseMode.HTML
                 )
         
         except Exception as e:
-            print(f"❌ Error sending daily recap to {telegram_id}: {e}")
+            logger.error("Error sending daily recap to %s: %s", telegram_id, e)